@@ -9,157 +9,291 @@ import os
 import base64
 import io
 import json
+import functools
+import threading
 from pathlib import Path
 
 try:
     import pydicom
     import numpy as np
+    import cv2
     from PIL import Image
 except ImportError as e:
     print(json.dumps({
         "success": False,
         "error": f"Missing required Python packages: {e}",
-        "message": "Please install: pip install pydicom Pillow numpy"
+        "message": "Please install: pip install pydicom Pillow numpy opencv-python"
     }))
     sys.exit(1)
 
-def convert_dicom_to_png(dicom_data):
+# Optional native codecs: when importable, pydicom decodes compressed
+# transfer syntaxes (JPEG, JPEG-LS, JPEG 2000, RLE) through C plugins
+# instead of failing - typical CT exports are compressed
+try:
+    import pylibjpeg  # noqa: F401
+except ImportError:
+    pass
+
+class Base64Writer(io.RawIOBase):
     """
-    Convert DICOM data to PNG base64 string - simplified reliable approach
+    File-like sink that base64-encodes bytes as the PNG encoder emits
+    them, so the raw PNG blob never exists alongside its base64 copy.
+    Carries a <3 byte remainder between writes to keep encoding aligned.
     """
-    try:
-        # Read DICOM from bytes - force read even with compression issues
-        ds = pydicom.dcmread(io.BytesIO(dicom_data), force=True)
-        
-        # Extract basic metadata - handle MultiValue objects
-        def safe_extract(attr_name, default='Unknown'):
-            try:
-                value = getattr(ds, attr_name, default)
-                # Convert MultiValue to list, single values to string
-                if hasattr(value, '__iter__') and not isinstance(value, str):
-                    return list(value)
-                return str(value) if value != default else default
-            except:
-                return default
-        
-        metadata = {
-            "modality": safe_extract('Modality'),
-            "patient_id": safe_extract('PatientID'),
-            "study_description": safe_extract('StudyDescription'),
-            "series_description": safe_extract('SeriesDescription'),
-            "rows": getattr(ds, 'Rows', 0),
-            "columns": getattr(ds, 'Columns', 0),
-            "slice_thickness": safe_extract('SliceThickness'),
-            "pixel_spacing": safe_extract('PixelSpacing'),
-        }
-        
-        # Check if this is a CT scan
-        if metadata["modality"] != 'CT':
-            return {
-                "success": False,
-                "error": f"Not a CT scan. Detected modality: {metadata['modality']}",
-                "metadata": metadata
-            }
-        
-        # Get pixel array - handle compressed data
+
+    def __init__(self):
+        self._encoded = bytearray()
+        self._rem = b''
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        data = self._rem + bytes(b)
+        aligned = (len(data) // 3) * 3
+        self._encoded += base64.b64encode(data[:aligned])
+        self._rem = data[aligned:]
+        return len(b)
+
+    def reset(self):
+        self._encoded.clear()
+        self._rem = b''
+
+    def getvalue(self):
+        """Flush any remainder and return the base64 string."""
+        if self._rem:
+            self._encoded += base64.b64encode(self._rem)
+            self._rem = b''
+        return self._encoded.decode('ascii')
+
+@functools.lru_cache(maxsize=8)
+def _build_ct_lut(rescale_slope, rescale_intercept, window_center, window_width, dtype):
+    """
+    Build a uint8 lookup table covering rescale + windowing for every
+    possible stored pixel value (256 or 65536 entries depending on dtype).
+    Applying the LUT is a single gather pass - no float32 promotion of
+    the full image needed.
+
+    Cached: slope/intercept/window are series-wide, so a 500-slice series
+    builds its table once. Callers must treat the returned array as
+    read-only.
+    """
+    dtype = np.dtype(dtype)
+    if dtype.itemsize == 1:
+        stored = np.arange(256, dtype=np.uint8).view(dtype).astype(np.float32)
+    else:
+        # Index is the stored value reinterpreted as uint16, so signed
+        # int16 pixels land in the upper half of the table
+        stored = np.arange(65536, dtype=np.uint16).view(dtype).astype(np.float32)
+    hu = stored * rescale_slope + rescale_intercept
+    img_min = window_center - window_width // 2
+    img_max = window_center + window_width // 2
+    np.clip(hu, img_min, img_max, out=hu)
+    hu -= img_min
+    hu *= 255.0 / (img_max - img_min)
+    return hu.astype(np.uint8)
+
+class DicomConverter:
+    """
+    Reusable DICOM to PNG converter. Holds a scratch BytesIO and a
+    preallocated uint8 output plane so batch callers converting many
+    slices don't pay per-slice buffer allocations.
+    """
+
+    def __init__(self):
+        self._writer = Base64Writer()
+        self._u8 = None
+
+    def convert(self, dicom_data):
+        """
+        Convert DICOM data to PNG base64 string - simplified reliable approach
+        """
         try:
-            pixel_array = ds.pixel_array.astype(np.float32)
-        except Exception as pixel_error:
-            # Try alternative approach for compressed data
-            if hasattr(ds, 'PixelData'):
-                # Raw pixel data available, try to interpret
-                pixel_data = ds.PixelData
-                rows = ds.Rows
-                cols = ds.Columns
-                
-                # Convert bytes to numpy array based on data type
-                if ds.BitsAllocated == 16:
-                    pixel_array = np.frombuffer(pixel_data, dtype=np.int16).reshape(rows, cols).astype(np.float32)
-                else:
-                    pixel_array = np.frombuffer(pixel_data, dtype=np.uint8).reshape(rows, cols).astype(np.float32)
-            else:
-                raise Exception(f"Cannot access pixel data: {str(pixel_error)}")
-        
-        # Apply DICOM rescale slope and intercept to get Hounsfield Units for CT
-        # This is critical for proper CT windowing
-        rescale_intercept = float(getattr(ds, 'RescaleIntercept', 0))
-        rescale_slope = float(getattr(ds, 'RescaleSlope', 1))
-        pixel_array = pixel_array * rescale_slope + rescale_intercept
-        
-        # Check if pixel array is valid (not all zeros or has no variation)
-        if pixel_array.max() == pixel_array.min():
-            raise Exception(f"Invalid pixel data: all pixels have same value ({pixel_array.min()}). File may be corrupted.")
-        
-        # Check if pixel array is all zeros
-        if pixel_array.max() == 0:
-            raise Exception("Invalid pixel data: all pixels are zero. File may be corrupted or empty.")
-        
-        # Apply windowing for CT scans using LUNG window for optimal pathology detection
-        # Lung window (WL: -600, WW: 1500) is ideal for detecting:
-        # - Pneumothorax, emphysema, nodules, infiltrates, pleural effusion
-        window_center = -600  # Lung window center (Hounsfield Units)
-        window_width = 1500   # Lung window width
+            # Read DICOM from bytes - force read even with compression issues
+            ds = pydicom.dcmread(io.BytesIO(dicom_data), force=True)
         
-        # Apply window/level transformation
-        img_min = window_center - window_width // 2
-        img_max = window_center + window_width // 2
-        windowed = np.clip(pixel_array, img_min, img_max)
+            # Extract basic metadata - handle MultiValue objects
+            def safe_extract(attr_name, default='Unknown'):
+                try:
+                    value = getattr(ds, attr_name, default)
+                    # Convert MultiValue to list, single values to string
+                    if hasattr(value, '__iter__') and not isinstance(value, str):
+                        return list(value)
+                    return str(value) if value != default else default
+                except:
+                    return default
         
-        # Normalize to 0-255 with proper contrast
-        normalized = ((windowed - img_min) / (img_max - img_min) * 255.0).astype(np.uint8)
-        image_8bit = normalized
-        
-        # Convert to PIL Image
-        image = Image.fromarray(image_8bit)
+            metadata = {
+                "modality": safe_extract('Modality'),
+                "patient_id": safe_extract('PatientID'),
+                "study_description": safe_extract('StudyDescription'),
+                "series_description": safe_extract('SeriesDescription'),
+                "rows": getattr(ds, 'Rows', 0),
+                "columns": getattr(ds, 'Columns', 0),
+                "slice_thickness": safe_extract('SliceThickness'),
+                "pixel_spacing": safe_extract('PixelSpacing'),
+            }
         
-        # Convert to RGB for better compatibility
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
+            # Check if this is a CT scan
+            if metadata["modality"] != 'CT':
+                return {
+                    "success": False,
+                    "error": f"Not a CT scan. Detected modality: {metadata['modality']}",
+                    "metadata": metadata
+                }
         
-        # Resize for cost optimization (original -> 384x384 max)
-        if max(image.size) > 384:
-            # Calculate new size maintaining aspect ratio
-            ratio = min(384 / image.width, 384 / image.height)
-            new_size = (int(image.width * ratio), int(image.height * ratio))
-            image = image.resize(new_size, Image.Resampling.LANCZOS)
+            # Get pixel array - compressed transfer syntaxes are handled by
+            # the native codec plugins registered at import
+            try:
+                raw_array = ds.pixel_array
+            except Exception as pixel_error:
+                raise Exception(f"Cannot access pixel data: {str(pixel_error)}")
+
+            # Check validity on the raw integer array before the float32 promotion
+            # (half the bytes to scan, same answer since rescale is linear)
+            raw_min = raw_array.min()
+            raw_max = raw_array.max()
+            if raw_min == raw_max:
+                raise Exception(f"Invalid pixel data: all pixels have same value ({raw_min}). File may be corrupted.")
+
+            # Check if pixel array is all zeros
+            if raw_max == 0:
+                raise Exception("Invalid pixel data: all pixels are zero. File may be corrupted or empty.")
+
+            # DICOM rescale slope and intercept map stored values to Hounsfield Units
+            # This is critical for proper CT windowing
+            rescale_intercept = float(getattr(ds, 'RescaleIntercept', 0))
+            rescale_slope = float(getattr(ds, 'RescaleSlope', 1))
+
+            # Apply windowing for CT scans using LUNG window for optimal pathology detection
+            # Lung window (WL: -600, WW: 1500) is ideal for detecting:
+            # - Pneumothorax, emphysema, nodules, infiltrates, pleural effusion
+            window_center = -600  # Lung window center (Hounsfield Units)
+            window_width = 1500   # Lung window width
+
+            if raw_array.dtype.kind in ('i', 'u') and raw_array.dtype.itemsize <= 2:
+                # Integer pixels: rescale + window + normalize via a single LUT
+                # gather pass, skipping the float32 promotion entirely
+                lut = _build_ct_lut(rescale_slope, rescale_intercept,
+                                    window_center, window_width, raw_array.dtype)
+                index_dtype = np.uint8 if raw_array.dtype.itemsize == 1 else np.uint16
+                # Gather into the preallocated output plane (reallocated
+                # only when the slice shape changes)
+                if self._u8 is None or self._u8.shape != raw_array.shape:
+                    self._u8 = np.empty(raw_array.shape, dtype=np.uint8)
+                image_8bit = np.take(lut, raw_array.view(index_dtype), out=self._u8)
+            else:
+                # Unusual pixel dtype: fall back to the in-place float32
+                # pipeline, skipping the rescale pass entirely when it is
+                # the identity (slope 1, intercept 0)
+                pixel_array = raw_array.astype(np.float32)
+                if rescale_slope != 1.0 or rescale_intercept != 0.0:
+                    np.multiply(pixel_array, rescale_slope, out=pixel_array)
+                    pixel_array += rescale_intercept
+
+                img_min = window_center - window_width // 2
+                img_max = window_center + window_width // 2
+                np.clip(pixel_array, img_min, img_max, out=pixel_array)
+                pixel_array -= img_min
+                pixel_array *= 255.0 / (img_max - img_min)
+                image_8bit = pixel_array.astype(np.uint8, copy=False)
         
-        # Save to bytes with compression
-        img_buffer = io.BytesIO()
-        image.save(img_buffer, format='PNG', optimize=True, compress_level=6)
-        img_buffer.seek(0)
+            # Convert to PIL Image - stays single-channel ('L'); PNG supports
+            # grayscale natively and the AI APIs accept it, so no need to
+            # triple the bytes with an RGB conversion
+            image = Image.fromarray(image_8bit)
+
+            # Resize for cost optimization (original -> 384x384 max)
+            if max(image.size) > 384:
+                # Calculate new size maintaining aspect ratio
+                ratio = min(384 / image.width, 384 / image.height)
+                new_size = (int(image.width * ratio), int(image.height * ratio))
+                # cv2 INTER_AREA is SIMD-accelerated and well-antialiased for
+                # downscales - much faster than PIL's Lanczos here
+                resized = cv2.resize(np.asarray(image), new_size, interpolation=cv2.INTER_AREA)
+                image = Image.fromarray(resized)
         
-        # Convert to base64
-        base64_string = base64.b64encode(img_buffer.getvalue()).decode('utf-8')
+            # Save with a fast Deflate setting (the PNG heads straight for
+            # base64/upload, not worth max compression effort), streaming
+            # the encoder output through the reusable Base64Writer so the
+            # raw PNG bytes are never materialized as a separate blob
+            writer = self._writer
+            writer.reset()
+            image.save(writer, format='PNG', optimize=False, compress_level=1)
+            base64_string = writer.getvalue()
         
-        return {
-            "success": True,
-            "base64_image": base64_string,
-            "metadata": metadata,
-            "image_info": {
-                "format": "PNG",
-                "size": image.size,
-                "mode": image.mode
+            return {
+                "success": True,
+                "base64_image": base64_string,
+                "metadata": metadata,
+                "image_info": {
+                    "format": "PNG",
+                    "size": image.size,
+                    "mode": image.mode
+                }
             }
-        }
         
-    except Exception as e:
-        return {
-            "success": False,
-            "error": f"Error converting DICOM: {str(e)}",
-            "metadata": {}
-        }
+        except Exception as e:
+            return {
+                "success": False,
+                "error": f"Error converting DICOM: {str(e)}",
+                "metadata": {}
+            }
+
+
+_local = threading.local()
+
+def convert_dicom_to_png(dicom_data):
+    """
+    Convert DICOM data to PNG base64 string - simplified reliable approach.
+    Thin wrapper over a thread-local DicomConverter so repeated calls
+    reuse its scratch buffers.
+    """
+    converter = getattr(_local, "converter", None)
+    if converter is None:
+        converter = _local.converter = DicomConverter()
+    return converter.convert(dicom_data)
+
+def serve():
+    """
+    Long-running mode for batch callers: read newline-delimited JSON
+    requests ({"path": "..."} or {"b64": "..."}) from stdin and write one
+    JSON result per line to stdout. Amortizes interpreter + pydicom/numpy
+    import startup across a whole series instead of paying it per slice.
+    """
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = json.loads(line)
+            if "path" in request:
+                with open(request["path"], 'rb') as f:
+                    dicom_data = f.read()
+            elif "b64" in request:
+                dicom_data = base64.b64decode(request["b64"])
+            else:
+                raise ValueError("Request must contain 'path' or 'b64'")
+            result = convert_dicom_to_png(dicom_data)
+        except Exception as e:
+            result = {"success": False, "error": f"Conversion failed: {str(e)}"}
+        print(json.dumps(result), flush=True)
 
 def main():
     """
     Main function to handle command line conversion
     """
+    if len(sys.argv) == 2 and sys.argv[1] == '--serve':
+        serve()
+        return
+
     if len(sys.argv) != 2:
         print(json.dumps({
             "success": False,
-            "error": "Usage: python dicom-converter.py <dicom_file_path>"
+            "error": "Usage: python dicom-converter.py <dicom_file_path> | --serve"
         }))
         sys.exit(1)
-    
+
     try:
         # Get DICOM file path from command line
         dicom_file_path = sys.argv[1]
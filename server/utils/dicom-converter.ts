@@ -1,4 +1,4 @@
-import { exec } from 'child_process';
+import { exec, spawn, type ChildProcessWithoutNullStreams } from 'child_process';
 import { promisify } from 'util';
 import path from 'path';
 import { fileURLToPath } from 'url';
@@ -7,6 +7,127 @@ import os from 'os';
 
 const execAsync = promisify(exec);
 
+// Persistent converter process (--serve mode): one python3 spawn per server
+// lifetime instead of one per slice, amortizing interpreter + pydicom/numpy
+// import startup (~400ms) across the whole study.
+let serveProcess: ChildProcessWithoutNullStreams | null = null;
+let serveQueue: Promise<unknown> = Promise.resolve();
+
+async function resolveScriptPath(): Promise<string> {
+  // Handle both dev and deployment environments
+  const currentDir = path.dirname(fileURLToPath(import.meta.url));
+  let scriptPath = path.join(currentDir, 'dicom-converter.py');
+
+  try {
+    await fs.access(scriptPath);
+  } catch {
+    // Try relative to server directory
+    const serverDir = path.join(process.cwd(), 'server', 'utils');
+    const altPath = path.join(serverDir, 'dicom-converter.py');
+
+    try {
+      await fs.access(altPath);
+      scriptPath = altPath;
+    } catch {
+      // Try relative to project root
+      scriptPath = path.join(process.cwd(), 'server', 'utils', 'dicom-converter.py');
+    }
+  }
+
+  return scriptPath;
+}
+
+function getServeProcess(scriptPath: string): ChildProcessWithoutNullStreams {
+  if (serveProcess && serveProcess.exitCode === null && !serveProcess.killed) {
+    return serveProcess;
+  }
+
+  const proc = spawn('python3', [scriptPath, '--serve'], { stdio: ['pipe', 'pipe', 'pipe'] });
+  proc.stderr.on('data', (chunk) => {
+    console.warn('⚠️ Python converter warning:', chunk.toString());
+  });
+  proc.on('error', () => {
+    // Standing listener so an 'error' with no request in flight (e.g. a
+    // spawn failure like ENOENT) can't crash the server as an unhandled
+    // event; the per-request listener in sendServeRequest rejects the
+    // pending request
+    if (serveProcess === proc) serveProcess = null;
+  });
+  proc.stdin.on('error', () => {
+    // stdin is its own stream and raises 'error' (EPIPE) as an unhandled
+    // event if the child dies mid-write - even when the write callback is
+    // also given the error. Swallow it and discard the process; the write
+    // callback in sendServeRequest rejects the pending request
+    discardServeProcess(proc);
+  });
+  proc.on('exit', () => {
+    if (serveProcess === proc) serveProcess = null;
+  });
+  serveProcess = proc;
+  return proc;
+}
+
+function discardServeProcess(proc: ChildProcessWithoutNullStreams): void {
+  // A request was abandoned mid-flight, so the pipe may still carry (or
+  // later receive) the response for it. Reusing this process would hand
+  // that stale payload to the next request, so kill it and let the next
+  // request spawn a fresh one.
+  if (serveProcess === proc) serveProcess = null;
+  proc.kill();
+}
+
+function sendServeRequest(
+  proc: ChildProcessWithoutNullStreams,
+  line: string,
+  timeoutMs: number
+): Promise<string> {
+  return new Promise((resolve, reject) => {
+    let buffer = '';
+    const onData = (chunk: Buffer) => {
+      buffer += chunk.toString();
+      const newline = buffer.indexOf('\n');
+      if (newline !== -1) {
+        cleanup();
+        resolve(buffer.slice(0, newline));
+      }
+    };
+    const onExit = () => {
+      cleanup();
+      reject(new Error('Converter process exited unexpectedly'));
+    };
+    const onError = (error: Error) => {
+      cleanup();
+      discardServeProcess(proc);
+      reject(error);
+    };
+    const timer = setTimeout(() => {
+      cleanup();
+      discardServeProcess(proc);
+      reject(new Error('timeout waiting for converter process'));
+    }, timeoutMs);
+    const cleanup = () => {
+      clearTimeout(timer);
+      proc.stdout.off('data', onData);
+      proc.off('exit', onExit);
+      proc.off('error', onError);
+    };
+    proc.stdout.on('data', onData);
+    proc.on('exit', onExit);
+    proc.on('error', onError);
+    proc.stdin.write(line + '\n', (writeError) => {
+      if (writeError) onError(writeError);
+    });
+  });
+}
+
+function runServeRequest(scriptPath: string, payload: object): Promise<string> {
+  // Serialize requests - the serve process answers in order on one pipe
+  const run = () => sendServeRequest(getServeProcess(scriptPath), JSON.stringify(payload), 60000);
+  const result = serveQueue.then(run, run);
+  serveQueue = result.catch(() => undefined);
+  return result;
+}
+
 export interface DicomConversionResult {
   success: boolean;
   base64_image?: string;
@@ -42,41 +163,29 @@ export async function convertDicomToPng(dicomBuffer: Buffer): Promise<DicomConve
     // Write DICOM buffer to temporary file
     await fs.writeFile(tempFilePath, dicomBuffer);
     
-    // Path to the Python converter script - handle both dev and deployment environments
-    const currentDir = path.dirname(fileURLToPath(import.meta.url));
-    let scriptPath = path.join(currentDir, 'dicom-converter.py');
-    
-    // Check if script exists, if not try alternative paths for deployment
+    // Path to the Python converter script
+    const scriptPath = await resolveScriptPath();
+
+    console.log('🐍 Executing Python DICOM converter...');
+    let stdout: string;
     try {
-      await fs.access(scriptPath);
-    } catch {
-      // Try relative to server directory
-      const serverDir = path.join(process.cwd(), 'server', 'utils');
-      const altPath = path.join(serverDir, 'dicom-converter.py');
-      
-      try {
-        await fs.access(altPath);
-        scriptPath = altPath;
-      } catch {
-        // Try relative to project root
-        const rootPath = path.join(process.cwd(), 'server', 'utils', 'dicom-converter.py');
-        scriptPath = rootPath;
+      // Preferred: feed the persistent --serve process
+      stdout = await runServeRequest(scriptPath, { path: tempFilePath });
+    } catch (serveError) {
+      // Fall back to a one-shot spawn if the persistent process is unusable
+      console.warn('⚠️ Persistent converter unavailable, falling back to one-shot:', serveError);
+      const command = `python3 "${scriptPath}" "${tempFilePath}"`;
+      const { stdout: execStdout, stderr } = await execAsync(command, {
+        timeout: 60000, // 60 second timeout for large DICOM files
+        maxBuffer: 10 * 1024 * 1024 // 10MB buffer for faster processing
+      });
+
+      if (stderr) {
+        console.warn('⚠️ Python converter warning:', stderr);
       }
+      stdout = execStdout;
     }
-    
-    // Execute Python script with file path
-    const command = `python3 "${scriptPath}" "${tempFilePath}"`;
-    
-    console.log('🐍 Executing Python DICOM converter...');
-    const { stdout, stderr } = await execAsync(command, {
-      timeout: 60000, // 60 second timeout for large DICOM files
-      maxBuffer: 10 * 1024 * 1024 // 10MB buffer for faster processing
-    });
-    
-    if (stderr) {
-      console.warn('⚠️ Python converter warning:', stderr);
-    }
-    
+
     // Parse JSON result from Python script
     const result: DicomConversionResult = JSON.parse(stdout.trim());
     
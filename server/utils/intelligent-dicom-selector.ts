@@ -9,6 +9,10 @@ interface IntelligentSelectionResult {
   selectedIndices: number[];
   totalSlices: number;
   selectedCount: number;
+  // Lung-windowed base64 PNGs of the selected slices, keyed by slice
+  // index - callers can use these directly instead of re-running the
+  // per-slice DICOM converter over the same buffers
+  converted?: Record<string, string>;
   error?: string;
 }
 
@@ -5,32 +5,78 @@ Uses 5-region quota system + variance-based prioritization for comprehensive pat
 """
 
 import sys
+import os
 import json
 import base64
 import numpy as np
 import pydicom
 from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+from scipy.ndimage import uniform_filter
+from PIL import Image
 import cv2
 
-def dicom_to_hu(dicom_data):
-    """Convert DICOM pixel data to Hounsfield Units (HU)."""
-    img = dicom_data.pixel_array.astype(np.float32)
-    slope = getattr(dicom_data, "RescaleSlope", 1)
-    intercept = getattr(dicom_data, "RescaleIntercept", 0)
-    return img * slope + intercept
-
-def get_lung_mask(slice_hu, lower=-1000, upper=-400, area_thresh=0.1):
-    """Detect if slice contains lung tissue based on HU thresholding."""
-    mask = np.logical_and(slice_hu > lower, slice_hu < upper)
-    lung_fraction = np.sum(mask) / mask.size
-    return lung_fraction >= area_thresh
-
-def calculate_slice_variance(hu_slice):
-    """Calculate variance score for a slice - higher variance = more likely pathology."""
+# Only the elements needed to decode pixels and rescale to HU - parsing
+# just these instead of the whole dataset skips most of pydicom's
+# per-element work. Image Pixel module tags are required by .pixel_array.
+_DECODE_TAGS = [
+    pydicom.tag.Tag(0x0028, 0x0002),  # SamplesPerPixel
+    pydicom.tag.Tag(0x0028, 0x0004),  # PhotometricInterpretation
+    pydicom.tag.Tag(0x0028, 0x0006),  # PlanarConfiguration
+    pydicom.tag.Tag(0x0028, 0x0008),  # NumberOfFrames
+    pydicom.tag.Tag(0x0028, 0x0010),  # Rows
+    pydicom.tag.Tag(0x0028, 0x0011),  # Columns
+    pydicom.tag.Tag(0x0028, 0x0100),  # BitsAllocated
+    pydicom.tag.Tag(0x0028, 0x0101),  # BitsStored
+    pydicom.tag.Tag(0x0028, 0x0102),  # HighBit
+    pydicom.tag.Tag(0x0028, 0x0103),  # PixelRepresentation
+    pydicom.tag.Tag(0x0028, 0x1052),  # RescaleIntercept
+    pydicom.tag.Tag(0x0028, 0x1053),  # RescaleSlope
+    pydicom.tag.Tag(0x7FE0, 0x0010),  # PixelData
+]
+
+def _decode_slice(buffer):
+    """
+    Worker: decode one base64 DICOM buffer to (pixel_array, slope, intercept).
+    Top-level function so it can be pickled by ProcessPoolExecutor.
+    Returns None for undecodable buffers to preserve slice positions.
+    """
+    try:
+        dcm = pydicom.dcmread(BytesIO(base64.b64decode(buffer)),
+                              specific_tags=_DECODE_TAGS, force=True)
+        return (dcm.pixel_array,
+                float(getattr(dcm, "RescaleSlope", 1)),
+                float(getattr(dcm, "RescaleIntercept", 0)))
+    except:
+        return None
+
+def get_lung_mask(slice_hu, lower=-1000, upper=-400, density_thresh=0.5):
+    """
+    Detect if slice contains lung tissue based on HU thresholding.
+    Looks for a contiguous lung-sized region via a 64x64 local-density
+    maximum rather than a global mask fraction, so scattered bowel gas
+    or a trachea-only slice no longer passes.
+
+    Returns (above_air, passes) where above_air is the slice_hu > lower
+    comparison - callers combine it with their own upper bound (the
+    variance mask uses -200, not this gate's -400) without paying the
+    lower-bound comparison again.
+    """
+    above_air = slice_hu > lower
+    mask = above_air & (slice_hu < upper)
+    density = uniform_filter(mask.astype(np.float32), size=64)
+    return above_air, density.max() > density_thresh
+
+def calculate_slice_variance(hu_slice, lung_mask=None):
+    """
+    Calculate variance score for a slice - higher variance = more likely
+    pathology. Pass a precomputed lung-range mask to skip rebuilding one.
+    """
     if hu_slice is None:
         return 0
     try:
-        lung_mask = np.logical_and(hu_slice > -1000, hu_slice < -200)
+        if lung_mask is None:
+            lung_mask = np.logical_and(hu_slice > -1000, hu_slice < -200)
         if np.sum(lung_mask) < 100:
             return 0
         lung_values = hu_slice[lung_mask]
@@ -39,6 +85,28 @@ def calculate_slice_variance(hu_slice):
     except:
         return 0
 
+def _hu_to_png_b64(hu):
+    """
+    Convert an HU slice to a base64 PNG with the same lung window
+    (WL -600 / WW 1500), 384px cap and fast PNG settings as the converter
+    scripts. Lets the selector emit selected slices directly, so the
+    pipeline skips a second pydicom decode per selected slice.
+    """
+    img_min = -600 - 1500 // 2
+    img_max = -600 + 1500 // 2
+    scaled = np.clip(hu, img_min, img_max)
+    scaled -= img_min
+    scaled *= 255.0 / (img_max - img_min)
+    image = Image.fromarray(scaled.astype(np.uint8, copy=False))
+    if max(image.size) > 384:
+        ratio = min(384 / image.width, 384 / image.height)
+        new_size = (int(image.width * ratio), int(image.height * ratio))
+        resized = cv2.resize(np.asarray(image), new_size, interpolation=cv2.INTER_AREA)
+        image = Image.fromarray(resized)
+    buf = BytesIO()
+    image.save(buf, format='PNG', optimize=False, compress_level=1)
+    return base64.b64encode(buf.getbuffer()).decode('ascii')
+
 def select_representative_slices(dicom_buffers, target_count=200):
     """
     Select slices with FULL CHEST COVERAGE using 5-region quota system.
@@ -59,49 +127,103 @@ def select_representative_slices(dicom_buffers, target_count=200):
         target_count: Target number of slices (default 200)
     
     Returns:
-        List of indices of selected slices with full chest coverage
+        Tuple of (selected indices with full chest coverage, dict mapping
+        str(index) -> base64 PNG of the lung-windowed slice) - the PNGs
+        let the caller skip a second per-slice conversion pass
     """
     
-    # Parse DICOM data
-    dicom_slices = []
-    for buffer in dicom_buffers:
-        try:
-            dcm_data = pydicom.dcmread(BytesIO(base64.b64decode(buffer)))
-            dicom_slices.append(dcm_data)
-        except Exception as e:
-            dicom_slices.append(None)
+    # Parse DICOM data - pydicom decode is CPU-bound pure Python and the
+    # dominant cost for large studies, so fan it out across processes.
+    # Small batches stay serial to skip the pool spin-up cost.
+    if len(dicom_buffers) < 8:
+        decoded_slices = [_decode_slice(buffer) for buffer in dicom_buffers]
+    else:
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            decoded_slices = list(executor.map(_decode_slice, dicom_buffers, chunksize=16))
     
-    # Convert to HU and find lung slices with variance scores
-    hu_slices = []
+    # Convert to HU and find lung slices with variance scores.
+    # All decoded slices are batched into one (N, H, W) stack so the HU
+    # conversion, lung masking and per-slice variance run as vectorized
+    # NumPy reductions instead of several Python-level passes per slice.
     lung_data = []  # (index, variance_score)
+    hu_by_index = {}  # HU planes kept so selected slices can be emitted as PNG
+
+    decoded = []  # (original index, pixel array, slope, intercept)
+    for i, result in enumerate(decoded_slices):
+        if result is not None:
+            arr, slope, intercept = result
+            decoded.append((i, arr, slope, intercept))
+
+    if decoded and len({arr.shape for _, arr, _, _ in decoded}) == 1:
+        indices = [i for i, _, _, _ in decoded]
+        arrays = np.stack([arr for _, arr, _, _ in decoded]).astype(np.float32)
+        slopes = np.array([s for _, _, s, _ in decoded], dtype=np.float32)
+        intercepts = np.array([b for _, _, _, b in decoded], dtype=np.float32)
+        # Identity rescale (slope 1, intercept 0 across the series) is
+        # common on pre-rescaled exports - skip the multiply-add pass
+        if not (np.all(slopes == 1.0) and np.all(intercepts == 0.0)):
+            np.multiply(arrays, slopes[:, None, None], out=arrays)
+            arrays += intercepts[:, None, None]
+
+        # Shared lower bound for the gate and variance masks - one
+        # comparison pass over the stack instead of two
+        above_air = arrays > -1000
+
+        # Lung-presence gate (same thresholds and 64x64 local-density
+        # criterion as get_lung_mask, run over the whole stack at once)
+        gate = (above_air & (arrays < -400)).astype(np.float32)
+        has_lung = uniform_filter(gate, size=(1, 64, 64)).max(axis=(1, 2)) > 0.5
+
+        # Masked variance per slice (same thresholds as calculate_slice_variance)
+        mask = above_air & (arrays < -200)
+        counts = mask.sum(axis=(1, 2))
+        safe_counts = np.maximum(counts, 1)
+        means = (arrays * mask).sum(axis=(1, 2), dtype=np.float64) / safe_counts
+        deviations = arrays - means.astype(np.float32)[:, None, None]
+        variances = (np.square(deviations) * mask).sum(axis=(1, 2), dtype=np.float64) / safe_counts
+
+        for k, idx in enumerate(indices):
+            hu_by_index[idx] = arrays[k]  # view into the stack, no copy
+            if has_lung[k]:
+                variance = float(variances[k]) if counts[k] >= 100 else 0.0
+                lung_data.append((idx, variance))
+    else:
+        # Mixed slice shapes - fall back to the per-slice path, reusing
+        # the above-air comparison from the gate for the variance mask
+        for idx, arr, slope, intercept in decoded:
+            try:
+                hu = arr.astype(np.float32)
+                if slope != 1.0 or intercept != 0.0:
+                    hu *= slope
+                    hu += intercept
+                hu_by_index[idx] = hu
+                above_air, passes = get_lung_mask(hu)
+                if passes:
+                    # Variance scores over the wider -200 upper bound,
+                    # matching the batched path above
+                    variance_mask = above_air & (hu < -200)
+                    lung_data.append((idx, calculate_slice_variance(hu, variance_mask)))
+            except:
+                continue
     
-    for i, dcm in enumerate(dicom_slices):
-        if dcm is None:
-            hu_slices.append(None)
-            continue
-            
-        try:
-            hu = dicom_to_hu(dcm)
-            hu_slices.append(hu)
-            
-            if get_lung_mask(hu):
-                variance = calculate_slice_variance(hu)
-                lung_data.append((i, variance))
-        except:
-            hu_slices.append(None)
-    
+    def finish(selected):
+        """Pair the selection with pre-rendered PNGs of those slices."""
+        converted = {str(idx): _hu_to_png_b64(hu_by_index[idx])
+                     for idx in selected if idx in hu_by_index}
+        return selected, converted
+
     # Fallback: if no lung slices detected, use all valid indices
     if not lung_data:
-        lung_indices = [i for i in range(len(dicom_slices)) if dicom_slices[i] is not None]
-        return lung_indices[:target_count]
-    
+        lung_indices = [i for i, _, _, _ in decoded]
+        return finish(lung_indices[:target_count])
+
     # Extract lung indices
     lung_indices = [idx for idx, _ in lung_data]
     variance_scores = {idx: var for idx, var in lung_data}
-    
+
     # If very few slices, return all of them
     if len(lung_indices) <= 10:
-        return lung_indices
+        return finish(lung_indices)
     
     # ===== 5-REGION QUOTA SYSTEM =====
     total_lung_slices = len(lung_indices)
@@ -120,8 +242,9 @@ def select_representative_slices(dicom_buffers, target_count=200):
     extra_slices = target_count % 5  # Distribute extras to central regions
     
     selected_indices = []
+    selected_set = set()  # incremental dedup instead of a final set() pass
     region_stats = {}
-    
+
     for region_name, (start_frac, end_frac) in regions.items():
         # Calculate slice range for this region
         start_idx = int(total_lung_slices * start_frac)
@@ -154,11 +277,12 @@ def select_representative_slices(dicom_buffers, target_count=200):
             high_var_count = int(region_quota * 0.7)
             uniform_count = region_quota - high_var_count
             
-            # High variance slices
+            # High variance slices (set for O(1) membership below)
             high_var_slices = [idx for idx, _ in region_slices_with_var[:high_var_count]]
-            
+            high_var_set = set(high_var_slices)
+
             # Uniform sample from remaining
-            remaining = [idx for idx in region_slices if idx not in high_var_slices]
+            remaining = [idx for idx in region_slices if idx not in high_var_set]
             if remaining and uniform_count > 0:
                 step = max(1, len(remaining) // uniform_count)
                 uniform_slices = [remaining[i * step] for i in range(min(uniform_count, len(remaining)))]
@@ -167,11 +291,14 @@ def select_representative_slices(dicom_buffers, target_count=200):
             
             selected_from_region = list(set(high_var_slices + uniform_slices))
         
-        selected_indices.extend(selected_from_region)
+        for idx in selected_from_region:
+            if idx not in selected_set:
+                selected_set.add(idx)
+                selected_indices.append(idx)
         region_stats[region_name] = len(selected_from_region)
-    
+
     # Sort by original index order
-    selected_indices = sorted(list(set(selected_indices)))
+    selected_indices.sort()
     
     # Log coverage stats
     print(f"🎯 FULL CHEST COVERAGE - 5-Region Quota System:", file=sys.stderr)
@@ -181,8 +308,8 @@ def select_representative_slices(dicom_buffers, target_count=200):
     print(f"   📍 LOWER (60-80%): {region_stats.get('LOWER', 0)} slices - ILD, pneumonia", file=sys.stderr)
     print(f"   📍 BASE (80-100%): {region_stats.get('BASE', 0)} slices - effusions, atelectasis", file=sys.stderr)
     print(f"   ✅ TOTAL: {len(selected_indices)} slices from {total_lung_slices} lung slices", file=sys.stderr)
-    
-    return selected_indices
+
+    return finish(selected_indices)
 
 def main():
     """CLI entry point for Node.js integration - reads from stdin."""
@@ -197,14 +324,17 @@ def main():
             sys.exit(1)
         
         # Perform intelligent selection
-        selected_indices = select_representative_slices(dicom_buffers, target_count)
-        
-        # Return results as JSON
+        selected_indices, converted = select_representative_slices(dicom_buffers, target_count)
+
+        # Return results as JSON - "converted" carries the lung-windowed
+        # PNGs of the selected slices so the caller can skip a second
+        # per-slice conversion pass over the same DICOM buffers
         result = {
             "success": True,
             "selectedIndices": selected_indices,
             "totalSlices": len(dicom_buffers),
-            "selectedCount": len(selected_indices)
+            "selectedCount": len(selected_indices),
+            "converted": converted
         }
         
         print(json.dumps(result))
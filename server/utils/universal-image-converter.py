@@ -9,37 +9,108 @@ import os
 import base64
 import io
 import json
+import functools
 from pathlib import Path
 
 try:
     import pydicom
     import numpy as np
+    import cv2
     from PIL import Image
 except ImportError as e:
     print(json.dumps({
         "success": False,
         "error": f"Missing required Python packages: {e}",
-        "message": "Please install: pip install pydicom Pillow numpy"
+        "message": "Please install: pip install pydicom Pillow numpy opencv-python"
     }))
     sys.exit(1)
 
+# Optional native codecs: when importable, pydicom decodes compressed
+# transfer syntaxes (JPEG, JPEG-LS, JPEG 2000, RLE) through C plugins
+# instead of failing - typical CT exports are compressed
+try:
+    import pylibjpeg  # noqa: F401
+except ImportError:
+    pass
+
 def is_dicom_data(data):
     """Check if data is DICOM format - handles both with and without DICM preamble"""
     try:
         # First check for DICM magic number at byte 128 (most common)
         if len(data) >= 132 and data[128:132] == b'DICM':
             return True
-        
-        # Try to read as DICOM using pydicom (handles files without DICM preamble)
+
+        # Cheap screen for headerless files before paying for a parse:
+        # a DICOM stream opens with a low-group element, little-endian
+        # group 0002 (file meta) or 0008 (identification). Anything else
+        # (PNG/JPEG/etc.) bails out here without touching pydicom.
+        if len(data) < 8 or data[:2] not in (b'\x02\x00', b'\x08\x00'):
+            return False
+
+        # Confirm with a capped parse - stop before pixel data and keep
+        # only the SOP Class UID element rather than the whole dataset
         try:
-            ds = pydicom.dcmread(io.BytesIO(data), force=True)
-            # If successful, it's a valid DICOM file
-            return hasattr(ds, 'pixel_array') or hasattr(ds, 'PixelData')
+            ds = pydicom.dcmread(io.BytesIO(data), force=True, stop_before_pixels=True,
+                                 specific_tags=[pydicom.tag.Tag(0x0008, 0x0016)])
+            return len(ds) > 0 or len(getattr(ds, 'file_meta', [])) > 0
         except:
             return False
     except:
         return False
 
+class Base64Writer(io.RawIOBase):
+    """
+    File-like sink that base64-encodes bytes as the PNG encoder emits
+    them, so the raw PNG blob never exists alongside its base64 copy.
+    Carries a <3 byte remainder between writes to keep encoding aligned.
+    """
+
+    def __init__(self):
+        self._encoded = bytearray()
+        self._rem = b''
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        data = self._rem + bytes(b)
+        aligned = (len(data) // 3) * 3
+        self._encoded += base64.b64encode(data[:aligned])
+        self._rem = data[aligned:]
+        return len(b)
+
+    def getvalue(self):
+        """Flush any remainder and return the base64 string."""
+        if self._rem:
+            self._encoded += base64.b64encode(self._rem)
+            self._rem = b''
+        return self._encoded.decode('ascii')
+
+@functools.lru_cache(maxsize=8)
+def _build_ct_lut(rescale_slope, rescale_intercept, window_center, window_width, dtype):
+    """
+    Build a uint8 lookup table covering rescale + windowing for every
+    possible stored pixel value, so conversion is one gather pass
+    instead of a float32 promotion of the full image.
+
+    Cached: slope/intercept/window are series-wide, so a batch of slices
+    builds its table once. Callers must treat the returned array as
+    read-only.
+    """
+    dtype = np.dtype(dtype)
+    if dtype.itemsize == 1:
+        stored = np.arange(256, dtype=np.uint8).view(dtype).astype(np.float32)
+    else:
+        # Index is the stored value reinterpreted as uint16
+        stored = np.arange(65536, dtype=np.uint16).view(dtype).astype(np.float32)
+    hu = stored * rescale_slope + rescale_intercept
+    img_min = window_center - window_width // 2
+    img_max = window_center + window_width // 2
+    np.clip(hu, img_min, img_max, out=hu)
+    hu -= img_min
+    hu *= 255.0 / (img_max - img_min)
+    return hu.astype(np.uint8)
+
 def convert_dicom_to_png(dicom_data):
     """Convert DICOM data to PNG base64 string"""
     try:
@@ -64,59 +135,63 @@ def convert_dicom_to_png(dicom_data):
             "columns": getattr(ds, 'Columns', 0)
         }
         
-        # Get pixel array
+        # Get pixel array - compressed transfer syntaxes are handled by
+        # the native codec plugins registered at import
         try:
-            pixel_array = ds.pixel_array.astype(np.float32)
+            raw_array = ds.pixel_array
         except Exception as pixel_error:
-            if hasattr(ds, 'PixelData'):
-                pixel_data = ds.PixelData
-                rows = ds.Rows
-                cols = ds.Columns
-                
-                if ds.BitsAllocated == 16:
-                    pixel_array = np.frombuffer(pixel_data, dtype=np.int16).reshape(rows, cols).astype(np.float32)
-                else:
-                    pixel_array = np.frombuffer(pixel_data, dtype=np.uint8).reshape(rows, cols).astype(np.float32)
-            else:
-                raise Exception(f"Cannot access pixel data: {str(pixel_error)}")
-        
-        # Apply DICOM rescale for CT (Hounsfield Units)
+            raise Exception(f"Cannot access pixel data: {str(pixel_error)}")
+
+        # Validate on the raw integer array before the float32 promotion
+        raw_min = raw_array.min()
+        if raw_min == raw_array.max():
+            raise Exception(f"Invalid pixel data: all pixels have same value ({raw_min})")
+
+        # DICOM rescale for CT (Hounsfield Units) + lung window
         rescale_intercept = float(getattr(ds, 'RescaleIntercept', 0))
         rescale_slope = float(getattr(ds, 'RescaleSlope', 1))
-        pixel_array = pixel_array * rescale_slope + rescale_intercept
-        
-        # Validate pixel data
-        if pixel_array.max() == pixel_array.min():
-            raise Exception(f"Invalid pixel data: all pixels have same value ({pixel_array.min()})")
-        
-        # Apply lung window for CT
         window_center = -600
         window_width = 1500
-        img_min = window_center - window_width // 2
-        img_max = window_center + window_width // 2
-        windowed = np.clip(pixel_array, img_min, img_max)
-        
-        # Normalize to 0-255
-        normalized = ((windowed - img_min) / (img_max - img_min) * 255.0).astype(np.uint8)
-        image = Image.fromarray(normalized)
-        
-        # Convert to RGB
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        # Resize if needed
+
+        if raw_array.dtype.kind in ('i', 'u') and raw_array.dtype.itemsize <= 2:
+            # Integer pixels: rescale + window + normalize in one LUT gather
+            lut = _build_ct_lut(rescale_slope, rescale_intercept,
+                                window_center, window_width, raw_array.dtype)
+            index_dtype = np.uint8 if raw_array.dtype.itemsize == 1 else np.uint16
+            image_8bit = lut[raw_array.view(index_dtype)]
+        else:
+            # Unusual pixel dtype: in-place float32 fallback; skip the
+            # rescale pass when it is the identity (slope 1, intercept 0)
+            pixel_array = raw_array.astype(np.float32)
+            if rescale_slope != 1.0 or rescale_intercept != 0.0:
+                np.multiply(pixel_array, rescale_slope, out=pixel_array)
+                pixel_array += rescale_intercept
+
+            img_min = window_center - window_width // 2
+            img_max = window_center + window_width // 2
+            np.clip(pixel_array, img_min, img_max, out=pixel_array)
+            pixel_array -= img_min
+            pixel_array *= 255.0 / (img_max - img_min)
+            image_8bit = pixel_array.astype(np.uint8, copy=False)
+
+        # Stays single-channel ('L') - PNG supports grayscale natively and
+        # the AI APIs accept it, so skip the RGB triplication
+        image = Image.fromarray(image_8bit)
+
+        # Resize if needed - cv2 INTER_AREA is SIMD-accelerated and
+        # well-antialiased for downscales
         if max(image.size) > 384:
             ratio = min(384 / image.width, 384 / image.height)
             new_size = (int(image.width * ratio), int(image.height * ratio))
-            image = image.resize(new_size, Image.Resampling.LANCZOS)
-        
-        # Save as PNG
-        img_buffer = io.BytesIO()
-        image.save(img_buffer, format='PNG', optimize=True, compress_level=6)
-        img_buffer.seek(0)
-        
-        base64_string = base64.b64encode(img_buffer.getvalue()).decode('utf-8')
+            resized = cv2.resize(np.asarray(image), new_size, interpolation=cv2.INTER_AREA)
+            image = Image.fromarray(resized)
         
+        # Save as PNG - fast Deflate setting, streamed straight into the
+        # base64 writer so the raw PNG bytes are never held separately
+        writer = Base64Writer()
+        image.save(writer, format='PNG', optimize=False, compress_level=1)
+        base64_string = writer.getvalue()
+
         return {
             "success": True,
             "base64_image": base64_string,
@@ -127,7 +202,7 @@ def convert_dicom_to_png(dicom_data):
                 "mode": image.mode
             }
         }
-        
+
     except Exception as e:
         return {
             "success": False,
@@ -149,23 +224,34 @@ def convert_standard_image_to_png(image_data):
             "original_size": list(image.size),
             "original_mode": image.mode
         }
-        
-        # Convert to RGB if needed
-        if image.mode != 'RGB':
+
+        # For JPEG input, let libjpeg decode straight to a reduced scale
+        # (DCT-domain downscale) - skips full-resolution entropy decode.
+        # No-op for other formats; draft never goes below the requested
+        # size, so the final cv2 resize still lands exactly on target.
+        image.draft('RGB', (384, 384))
+
+        # Grayscale sources stay single-channel (PNG 'L' mode compresses
+        # ~3x smaller); color photos keep RGB
+        if image.mode in ('L', 'LA', 'I;16', '1'):
+            if image.mode != 'L':
+                image = image.convert('L')
+        elif image.mode != 'RGB':
             image = image.convert('RGB')
         
-        # Resize if needed (maintain aspect ratio)
+        # Resize if needed (maintain aspect ratio) - cv2 INTER_AREA is
+        # SIMD-accelerated and well-antialiased for downscales
         if max(image.size) > 384:
             ratio = min(384 / image.width, 384 / image.height)
             new_size = (int(image.width * ratio), int(image.height * ratio))
-            image = image.resize(new_size, Image.Resampling.LANCZOS)
-        
-        # Save as PNG
-        img_buffer = io.BytesIO()
-        image.save(img_buffer, format='PNG', optimize=True, compress_level=6)
-        img_buffer.seek(0)
+            resized = cv2.resize(np.asarray(image), new_size, interpolation=cv2.INTER_AREA)
+            image = Image.fromarray(resized)
         
-        base64_string = base64.b64encode(img_buffer.getvalue()).decode('utf-8')
+        # Save as PNG - fast Deflate setting, streamed straight into the
+        # base64 writer so the raw PNG bytes are never held separately
+        writer = Base64Writer()
+        image.save(writer, format='PNG', optimize=False, compress_level=1)
+        base64_string = writer.getvalue()
         
         return {
             "success": True,
@@ -201,15 +287,44 @@ def convert_to_png(image_data):
             "metadata": {}
         }
 
+def serve():
+    """
+    Long-running mode for batch callers: read newline-delimited JSON
+    requests ({"path": "..."} or {"b64": "..."}) from stdin and write one
+    JSON result per line to stdout. Amortizes interpreter + pydicom/numpy
+    import startup across a whole series instead of paying it per slice.
+    """
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = json.loads(line)
+            if "path" in request:
+                with open(request["path"], 'rb') as f:
+                    image_data = f.read()
+            elif "b64" in request:
+                image_data = base64.b64decode(request["b64"])
+            else:
+                raise ValueError("Request must contain 'path' or 'b64'")
+            result = convert_to_png(image_data)
+        except Exception as e:
+            result = {"success": False, "error": f"Conversion failed: {str(e)}"}
+        print(json.dumps(result), flush=True)
+
 def main():
     """Main function to handle command line conversion"""
+    if len(sys.argv) == 2 and sys.argv[1] == '--serve':
+        serve()
+        return
+
     if len(sys.argv) != 2:
         print(json.dumps({
             "success": False,
-            "error": "Usage: python universal-image-converter.py <image_file_path>"
+            "error": "Usage: python universal-image-converter.py <image_file_path> | --serve"
         }))
         sys.exit(1)
-    
+
     try:
         # Get image file path from command line
         image_file_path = sys.argv[1]